@@ -3,8 +3,30 @@ import polars as pl
 from typing import Any
 from pathlib import Path
 from dataclasses import dataclass
+from functools import cached_property
 from typing import Optional
 
+# Model files at least this large are parsed by Polars instead of the stdlib.
+NATIVE_JSON_THRESHOLD = 8 * 1024 * 1024
+
+# Dtypes of the known model columns; any other keys in the JSON are kept as
+# parsed.
+ROOMS_SCHEMA = {
+    "id": pl.Utf8,
+    "type": pl.Utf8,
+    "capacity": pl.Int64,
+    "for": pl.List(pl.Utf8),
+}
+TEACHERS_SCHEMA = {"id": pl.Utf8, "name": pl.Utf8, "subjects": pl.List(pl.Utf8)}
+SUBJECTS_SCHEMA = {"id": pl.Utf8, "name": pl.Utf8, "type": pl.Utf8}
+GROUPS_SCHEMA = {
+    "id": pl.Utf8,
+    "name": pl.Utf8,
+    "subjects": pl.List(pl.Utf8),
+    "size": pl.Int64,
+}
+BREAKS_SCHEMA = {"day": pl.Utf8, "time": pl.Utf8}
+
 
 @dataclass
 class Model:
@@ -17,6 +39,9 @@ class Model:
 
     @classmethod
     def from_json(cls, file: Path) -> "Model":
+        if Path(file).stat().st_size >= NATIVE_JSON_THRESHOLD:
+            return cls._from_json_native(file)
+
         with open(file, "r", encoding="utf-8") as f:
             data = json.load(f)
 
@@ -30,16 +55,20 @@ class Model:
             if "size" not in group:
                 group["size"] = data["modifiers"]["default_group_size"] or 50
 
-        rooms = pl.DataFrame(rooms_data)
-        teachers = pl.DataFrame(data["teachers"])
-        subjects = pl.DataFrame(data["subjects"])
-        groups = pl.DataFrame(groups_data)
+        rooms = cls._table(rooms_data, ROOMS_SCHEMA)
+        teachers = cls._table(data["teachers"], TEACHERS_SCHEMA)
+        subjects = cls._table(data["subjects"], SUBJECTS_SCHEMA)
+        groups = cls._table(groups_data, GROUPS_SCHEMA)
         modifiers = data["modifiers"]
 
         slots = {
-            "days": pl.DataFrame({"day": data["slots"]["days"]}),
-            "times": pl.DataFrame({"time": data["slots"]["times"]}),
-            "breaks": pl.DataFrame(data["slots"].get("breaks", [])),
+            "days": pl.DataFrame(
+                {"day": data["slots"]["days"]}, schema={"day": pl.Utf8}
+            ),
+            "times": pl.DataFrame(
+                {"time": data["slots"]["times"]}, schema={"time": pl.Utf8}
+            ),
+            "breaks": cls._table(data["slots"].get("breaks", []), BREAKS_SCHEMA),
         }
 
         return cls(
@@ -51,6 +80,90 @@ class Model:
             slots,
         )
 
+    @classmethod
+    def _table(cls, rows: list[dict[str, Any]], schema: dict[str, Any]) -> pl.DataFrame:
+        df = pl.DataFrame(rows, schema_overrides=schema, infer_schema_length=None)
+        return cls._conform(df, schema)
+
+    @classmethod
+    def _conform(cls, df: pl.DataFrame, schema: dict[str, Any]) -> pl.DataFrame:
+        """
+        Cast the known columns to their dtypes and add missing ones as typed
+        nulls, leaving every other column untouched
+        """
+        return df.with_columns(
+            pl.col(name).cast(dtype)
+            if name in df.columns
+            else pl.Series(name, [None] * df.height, dtype=dtype)
+            for name, dtype in schema.items()
+        )
+
+    @classmethod
+    def _from_json_native(cls, file: Path) -> "Model":
+        """
+        Parse the model with Polars' native JSON reader, so large entity arrays
+        never materialise as Python dicts
+        """
+        raw = pl.read_json(file)
+        modifiers = raw["modifiers"][0]
+        slots_data = raw["slots"][0]
+
+        def table(name: str) -> pl.DataFrame:
+            # A missing or empty array has no struct fields to unnest; return an
+            # empty frame and let `_conform` add the typed columns.
+            dtype = raw.schema.get(name)
+            if not (isinstance(dtype, pl.List) and isinstance(dtype.inner, pl.Struct)):
+                return pl.DataFrame()
+            return raw.select(pl.col(name).explode()).unnest(name)
+
+        def with_default(df: pl.DataFrame, column: str, default: int) -> pl.DataFrame:
+            if df.width == 0:
+                return df
+            if column not in df.columns:
+                return df.with_columns(pl.lit(default, dtype=pl.Int64).alias(column))
+            return df.with_columns(pl.col(column).fill_null(default))
+
+        rooms = with_default(
+            table("rooms"), "capacity", modifiers["default_room_capacity"] or 50
+        )
+        groups = with_default(
+            table("groups"), "size", modifiers["default_group_size"] or 50
+        )
+
+        slots = {
+            "days": pl.DataFrame({"day": slots_data["days"]}, schema={"day": pl.Utf8}),
+            "times": pl.DataFrame(
+                {"time": slots_data["times"]}, schema={"time": pl.Utf8}
+            ),
+            "breaks": cls._table(slots_data.get("breaks") or [], BREAKS_SCHEMA),
+        }
+
+        # Same dtypes and known columns as the stdlib path, whatever the size.
+        return cls(
+            cls._conform(rooms, ROOMS_SCHEMA),
+            cls._conform(table("teachers"), TEACHERS_SCHEMA),
+            cls._conform(table("subjects"), SUBJECTS_SCHEMA),
+            cls._conform(groups, GROUPS_SCHEMA),
+            modifiers,
+            slots,
+        )
+
+    @cached_property
+    def room_capacity(self) -> dict[str, int]:
+        return self._room_capacity_map(self.rooms)
+
+    @cached_property
+    def group_size(self) -> dict[str, int]:
+        return self._group_size_map(self.groups)
+
+    @classmethod
+    def _room_capacity_map(cls, rooms_df: pl.DataFrame) -> dict[str, int]:
+        return dict(zip(rooms_df["id"].to_list(), rooms_df["capacity"].to_list()))
+
+    @classmethod
+    def _group_size_map(cls, groups_df: pl.DataFrame) -> dict[str, int]:
+        return dict(zip(groups_df["id"].to_list(), groups_df["size"].to_list()))
+
     @classmethod
     def get_available_groups(cls, df: pl.DataFrame) -> list[str]:
         return sorted(df.select("Groups").unique().to_series().to_list())
@@ -69,8 +182,11 @@ class Model:
 
     @classmethod
     def get_available_days(cls, df: pl.DataFrame) -> list[str]:
+        return cls._order_days(df.select("Day").unique().to_series().to_list())
+
+    @classmethod
+    def _order_days(cls, available_days: list[str]) -> list[str]:
         days_order = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-        available_days = df.select("Day").unique().to_series().to_list()
         return [day for day in days_order if day in available_days]
 
     @classmethod
@@ -98,54 +214,47 @@ class Model:
         elif for_room is not None:
             df = df.filter(pl.col("Room") == for_room)
 
+        return cls.timetable_from_partition(df, for_room=for_room)
+
+    @classmethod
+    def timetable_from_partition(
+        cls, df: pl.DataFrame, for_room: Optional[str] = None
+    ) -> pl.DataFrame:
+        """
+        Build a timetable from rows already filtered down to one group, teacher
+        or room (pass `for_room` for the latter)
+        """
         if df.height == 0:
             default_times = ["08:00", "09:00", "11:00", "13:00", "14:00", "16:00"]
             default_days = ["Mon", "Tue", "Wed", "Thu", "Fri"]
-            empty_df = pl.DataFrame({"Day": default_days})
-            for time in default_times:
-                empty_df = empty_df.with_columns(pl.lit(None).alias(time))
-            return empty_df
+            return pl.DataFrame({"Day": default_days}).with_columns(
+                pl.lit(None).alias(time) for time in default_times
+            )
 
         if for_room is not None:
-            df = df.with_columns(
-                pl.struct(["Subject", "Teacher", "Groups"])
-                .map_elements(
-                    lambda x: json.dumps(
-                        {
-                            "subject": x["Subject"],
-                            "teacher": x["Teacher"],
-                            "group": x["Groups"],
-                            "room": for_room,
-                        },
-                        ensure_ascii=False,
-                    ),
-                    return_dtype=pl.Utf8,
-                )
-                .alias("cell_value")
+            cell = pl.struct(
+                pl.col("Subject").alias("subject"),
+                pl.col("Teacher").alias("teacher"),
+                pl.col("Groups").alias("group"),
+                pl.lit(for_room).alias("room"),
             )
         else:
-            df = df.with_columns(
-                pl.struct(["Subject", "Teacher", "Room", "Groups"])
-                .map_elements(
-                    lambda x: json.dumps(
-                        {
-                            "subject": x["Subject"],
-                            "teacher": x["Teacher"],
-                            "room": x["Room"],
-                            "group": x["Groups"],
-                        },
-                        ensure_ascii=False,
-                    ),
-                    return_dtype=pl.Utf8,
-                )
-                .alias("cell_value")
+            cell = pl.struct(
+                pl.col("Subject").alias("subject"),
+                pl.col("Teacher").alias("teacher"),
+                pl.col("Room").alias("room"),
+                pl.col("Groups").alias("group"),
             )
+        df = df.with_columns(cell.struct.json_encode().alias("cell_value"))
 
         times = cls.get_available_times(df)
         days_in_data = cls.get_available_days(df)
 
-        pivot = df.pivot(
-            values="cell_value", index="Day", on="Time", aggregate_function="first"
+        # Equivalent to pivoting on Time with "first", but the columns are
+        # known up front so it stays a plain (lazy-friendly) aggregation.
+        pivot = df.group_by("Day").agg(
+            pl.col("cell_value").filter(pl.col("Time") == t).first().alias(t)
+            for t in times
         )
 
         pivot = (
@@ -158,8 +267,7 @@ class Model:
             .drop("day_order")
         )
 
-        column_order = ["Day"] + times
-        pivot = pivot.select([c for c in column_order if c in pivot.columns])
+        pivot = pivot.select(["Day"] + times)
 
         return pivot
 
@@ -167,16 +275,23 @@ class Model:
     def timetable_to_dicts(
         cls, df: pl.DataFrame
     ) -> list[dict[str, str | dict[str, str]]]:
-        result = []
-
-        for row in df.to_dicts():
-            parsed_row = {"Day": row["Day"]}
-            for key, value in row.items():
-                if key != "Day":
-                    parsed_row[key] = json.loads(value) if value is not None else None
-            result.append(parsed_row)
-
-        return result
+        # All-null columns (e.g. an empty timetable) have no string dtype to decode.
+        cells = [c for c in df.columns if c != "Day" and df.schema[c] == pl.Utf8]
+        if not cells:
+            return df.to_dicts()
+
+        # Every cell shares the keys written by `solution_to_timetable`; take
+        # their order from the first non-null cell so the decoded dicts keep it.
+        # String columns can still be all null, e.g. an empty timetable read
+        # back from CSV, in which case there is nothing to decode.
+        sample = next((v for c in cells for v in df[c].drop_nulls().head(1)), None)
+        if sample is None:
+            return df.to_dicts()
+
+        dtype = pl.Struct({key: pl.Utf8 for key in json.loads(sample)})
+        return df.with_columns(
+            pl.col(c).str.json_decode(dtype) for c in cells
+        ).to_dicts()
 
     def to_json(self, file: Path) -> None:
         data = {
@@ -192,42 +307,88 @@ class Model:
             "modifiers": self.modifiers,
         }
 
+        # json.dumps encodes in one shot with the C encoder; json.dump falls
+        # back to the pure-Python iterative encoder.
         with open(file, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
+            f.write(json.dumps(data, indent=2))
+
+    def write_ipc(self, directory: Path) -> None:
+        """
+        Write every table as an Arrow IPC file (plus the modifiers as JSON) so
+        `from_ipc` can load the model without parsing JSON again
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in ("rooms", "teachers", "subjects", "groups"):
+            getattr(self, name).write_ipc(directory / f"{name}.ipc")
+        for name, df in self.slots.items():
+            df.write_ipc(directory / f"slots_{name}.ipc")
+        (directory / "modifiers.json").write_text(json.dumps(self.modifiers))
+
+    @classmethod
+    def from_ipc(cls, directory: Path) -> "Model":
+        def read(name: str) -> pl.DataFrame:
+            return pl.read_ipc(directory / f"{name}.ipc")
+
+        return cls(
+            read("rooms"),
+            read("teachers"),
+            read("subjects"),
+            read("groups"),
+            json.loads((directory / "modifiers.json").read_text()),
+            {name: read(f"slots_{name}") for name in ("days", "times", "breaks")},
+        )
 
     @classmethod
     def get_summary(cls, df: pl.DataFrame, rooms_df: pl.DataFrame = None, groups_df: pl.DataFrame = None) -> dict[str, Any]:
+        lazy = df.lazy()
+        (
+            groups,
+            teachers,
+            rooms,
+            days,
+            times,
+            subjects,
+            per_group,
+            per_teacher,
+            per_room,
+            per_day,
+        ) = pl.collect_all(
+            [
+                lazy.select(pl.col("Groups").unique().sort()),
+                lazy.select(pl.col("Teacher").unique().sort()),
+                lazy.select(pl.col("Room").unique().sort()),
+                lazy.select(pl.col("Day").unique()),
+                lazy.select(pl.col("Time").unique().sort()),
+                lazy.select(pl.col("Subject").unique().sort()),
+                lazy.group_by("Groups").len().sort("Groups"),
+                lazy.group_by("Teacher").len().sort("Teacher"),
+                lazy.group_by("Room").len().sort("Room"),
+                lazy.group_by("Day").len().sort("Day"),
+            ]
+        )
+
         summary = {
             "total_classes": df.height,
-            "groups": cls.get_available_groups(df),
-            "teachers": cls.get_available_teachers(df),
-            "rooms": cls.get_available_rooms(df),
-            "days": cls.get_available_days(df),
-            "times": cls.get_available_times(df),
-            "subjects": sorted(df.select("Subject").unique().to_series().to_list()),
+            "groups": groups.to_series().to_list(),
+            "teachers": teachers.to_series().to_list(),
+            "rooms": rooms.to_series().to_list(),
+            "days": cls._order_days(days.to_series().to_list()),
+            "times": times.to_series().to_list(),
+            "subjects": subjects.to_series().to_list(),
         }
 
         summary["stats"] = {
-            "classes_per_group": df.group_by("Groups").len().sort("Groups").to_dicts(),
-            "classes_per_teacher": df.group_by("Teacher")
-            .len()
-            .sort("Teacher")
-            .to_dicts(),
-            "classes_per_room": df.group_by("Room").len().sort("Room").to_dicts(),
-            "classes_per_day": df.group_by("Day").len().sort("Day").to_dicts(),
+            "classes_per_group": per_group.to_dicts(),
+            "classes_per_teacher": per_teacher.to_dicts(),
+            "classes_per_room": per_room.to_dicts(),
+            "classes_per_day": per_day.to_dicts(),
         }
 
         if rooms_df is not None:
-            summary["room_capacities"] = {
-                room["id"]: room.get("capacity", 50)
-                for room in rooms_df.to_dicts()
-            }
+            summary["room_capacities"] = cls._room_capacity_map(rooms_df)
 
         if groups_df is not None:
-            summary["group_sizes"] = {
-                group["id"]: group.get("size", 0)
-                for group in groups_df.to_dicts()
-            }
+            summary["group_sizes"] = cls._group_size_map(groups_df)
 
         return summary
 
@@ -239,52 +400,30 @@ class Model:
             "group_conflicts": [],
         }
 
-        time_slots = df.select(["Day", "Time"]).unique()
-
-        for row in time_slots.to_dicts():
-            day, time = row["Day"], row["Time"]
-            slot_classes = df.filter((pl.col("Day") == day) & (pl.col("Time") == time))
-
-            teacher_counts = slot_classes.group_by("Teacher").len()
-            room_counts = slot_classes.group_by("Room").len()
-            group_counts = slot_classes.group_by("Groups").len()
-
-            for teacher_row in teacher_counts.filter(pl.col("len") > 1).to_dicts():
-                teacher_classes = slot_classes.filter(
-                    pl.col("Teacher") == teacher_row["Teacher"]
-                ).to_dicts()
-                conflicts["teacher_conflicts"].append(
-                    {
-                        "day": day,
-                        "time": time,
-                        "teacher": teacher_row["Teacher"],
-                        "classes": teacher_classes,
-                    }
-                )
-
-            for room_row in room_counts.filter(pl.col("len") > 1).to_dicts():
-                room_classes = slot_classes.filter(
-                    pl.col("Room") == room_row["Room"]
-                ).to_dicts()
-                conflicts["room_conflicts"].append(
-                    {
-                        "day": day,
-                        "time": time,
-                        "room": room_row["Room"],
-                        "classes": room_classes,
-                    }
-                )
+        axes = [
+            ("teacher_conflicts", "Teacher", "teacher"),
+            ("room_conflicts", "Room", "room"),
+            ("group_conflicts", "Groups", "group"),
+        ]
+
+        lazy = df.lazy()
+        clashes = pl.collect_all(
+            [
+                lazy.group_by(["Day", "Time", column], maintain_order=True)
+                .agg(pl.len().alias("n"), pl.struct(df.columns).alias("classes"))
+                .filter(pl.col("n") > 1)
+                for _, column, _ in axes
+            ]
+        )
 
-            for group_row in group_counts.filter(pl.col("len") > 1).to_dicts():
-                group_classes = slot_classes.filter(
-                    pl.col("Groups") == group_row["Groups"]
-                ).to_dicts()
-                conflicts["group_conflicts"].append(
+        for (key, column, field), axis_clashes in zip(axes, clashes):
+            for row in axis_clashes.iter_rows(named=True):
+                conflicts[key].append(
                     {
-                        "day": day,
-                        "time": time,
-                        "group": group_row["Groups"],
-                        "classes": group_classes,
+                        "day": row["Day"],
+                        "time": row["Time"],
+                        field: row[column],
+                        "classes": row["classes"],
                     }
                 )
 
@@ -295,31 +434,45 @@ class Model:
         """
         Detect cases where group size exceeds room capacity
         """
-        violations = []
-
-        room_capacity = {room["id"]: room.get("capacity", 50) for room in rooms_df.to_dicts()}
-        group_size = {group["id"]: group.get("size", 0) for group in groups_df.to_dicts()}
-
-        for row in df.to_dicts():
-            room_id = row["Room"]
-            groups_str = row["Groups"]
-
-            group_ids = [g.strip() for g in groups_str.split(",")]
-
-            total_students = sum(group_size.get(group_id, 0) for group_id in group_ids)
-            room_cap = room_capacity.get(room_id, 50)
-
-            if total_students > room_cap:
-                violations.append({
-                    "day": row["Day"],
-                    "time": row["Time"],
-                    "subject": row["Subject"],
-                    "teacher": row["Teacher"],
-                    "room": room_id,
-                    "room_capacity": room_cap,
-                    "groups": group_ids,
-                    "total_students": total_students,
-                    "overflow": total_students - room_cap
-                })
-
-        return violations
+        if df.height == 0:
+            return []
+
+        sizes = groups_df.select(pl.col("id").alias("group_id"), pl.col("size"))
+        capacities = rooms_df.select(
+            pl.col("id").alias("Room"), pl.col("capacity").alias("room_capacity")
+        )
+
+        rows = df.with_row_index("row").with_columns(
+            pl.col("Groups")
+            .str.split(",")
+            .list.eval(pl.element().str.strip_chars())
+            .alias("groups")
+        )
+        totals = (
+            rows.select("row", pl.col("groups").alias("group_id"))
+            .explode("group_id")
+            .join(sizes, on="group_id", how="left")
+            .group_by("row")
+            .agg(pl.col("size").fill_null(0).sum().alias("total_students"))
+        )
+
+        violations = (
+            rows.join(totals, on="row")
+            .join(capacities, on="Room", how="left")
+            .with_columns(pl.col("room_capacity").fill_null(50))
+            .filter(pl.col("total_students") > pl.col("room_capacity"))
+            .sort("row")
+            .select(
+                pl.col("Day").alias("day"),
+                pl.col("Time").alias("time"),
+                pl.col("Subject").alias("subject"),
+                pl.col("Teacher").alias("teacher"),
+                pl.col("Room").alias("room"),
+                "room_capacity",
+                "groups",
+                "total_students",
+                (pl.col("total_students") - pl.col("room_capacity")).alias("overflow"),
+            )
+        )
+
+        return violations.to_dicts()
@@ -1,29 +1,134 @@
 import json as json
+import multiprocessing
 import os
 import sys
-from .model import Model
+import shutil
 from pathlib import Path
-from .solver import Solver
+from functools import partial
+from typing import TYPE_CHECKING, Any
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
 
-if __name__ == "__main__":
-    parent = Path(__file__).parent
+# Polars and the model are only imported once they are needed, so a bad
+# invocation fails before the Polars extension is loaded.
+if TYPE_CHECKING:
+    import polars as pl
 
-    if len(sys.argv) > 1:
-        model_file = sys.argv[1]
-    else:
-        raise ValueError("Model file not specified.")
-    model_path = parent / model_file
-    model_name = Path(model_file).stem
+    from .model import Model
 
-    solution_base = parent / f"solutions/{model_name}"
-    solution_csv = solution_base / "solution.csv"
-    solution_csv.parent.mkdir(parents=True, exist_ok=True)
+# Teacher and room names become file names: spaces to underscores, dots dropped.
+_URL_SAFE = str.maketrans({" ": "_", ".": None})
+
+# One encoder for every report; json.dumps would build a new one per call.
+encode_json = json.JSONEncoder(indent=2).encode
+
+# Each timetable takes well under a millisecond to write, while every pool
+# worker pays for its own start-up and Polars import, so smaller solutions are
+# written serially.
+PARALLEL_MIN_ENTITIES = 1000
+
+
+def _limit_polars_threads() -> None:
+    # Runs in each worker before Polars is imported; the pool already provides
+    # the parallelism, so one Polars thread per worker avoids oversubscription.
+    os.environ["POLARS_MAX_THREADS"] = "1"
+
+
+def _make_pool(n_tasks: int, min_tasks: int) -> ProcessPoolExecutor | None:
+    """
+    A spawn pool sized to the work, or None when running serially is cheaper
+    """
+    workers = min(os.cpu_count() or 1, n_tasks)
+    if n_tasks < min_tasks or workers < 2:
+        return None
+    # Polars is multi-threaded, so workers are spawned rather than forked.
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_limit_polars_threads,
+    )
+
+
+def _run_all(
+    pool: ProcessPoolExecutor | None,
+    fn: Callable[..., None],
+    jobs: list[tuple[Any, ...]],
+) -> None:
+    if pool is None:
+        for args in jobs:
+            fn(*args)
+        return
+    for future in [pool.submit(fn, *args) for args in jobs]:
+        future.result()
+
+
+def _write_timetable(
+    df: "pl.DataFrame", for_room: str | None, csv_file: Path, json_file: Path
+) -> None:
+    from .model import Model
+
+    timetable = Model.timetable_from_partition(df, for_room=for_room)
+    dicts = Model.timetable_to_dicts(timetable)
+
+    timetable.write_csv(csv_file)
+    json_file.write_text(encode_json(dicts))
+
+
+def _run_variant(
+    model: "Model", seed: int | None
+) -> tuple["pl.DataFrame", list[tuple[str, str]]]:
+    """
+    Solve the model once with the given tie-break seed
+    """
+    from .solver import Solver
 
-    model = Model.from_json(model_path)
     solver = Solver(model)
+    return solver.solve(seed), solver.unassigned
+
+
+def _solution_key(solution: "pl.DataFrame") -> frozenset[tuple[Any, ...]]:
+    """
+    Order-independent identity of a solution, used to drop duplicate variants
+    """
+    return frozenset(solution.iter_rows())
+
 
-    solution = solver.solve()
-    solution.write_csv(Path(solution_csv))
+def _report_unassigned(unassigned: list[tuple[str, str]]) -> None:
+    for subject_id, group_id in unassigned:
+        print(f"[!] Could not schedule {subject_id} for group {group_id}.")
+
+
+def _clear_solution(solution_base: Path) -> None:
+    """
+    Remove what an earlier run wrote, whether one solution or several variants,
+    so the two layouts never end up side by side
+    """
+    for name in (
+        "solution.csv",
+        "summary.json",
+        "conflicts.json",
+        "capacity_violations.json",
+    ):
+        (solution_base / name).unlink(missing_ok=True)
+    for name in ("groups", "teachers", "rooms"):
+        if (solution_base / name).is_dir():
+            shutil.rmtree(solution_base / name)
+    for variant in solution_base.glob("variant_*"):
+        if variant.is_dir():
+            shutil.rmtree(variant)
+
+
+def _write_solution(
+    solution: "pl.DataFrame",
+    solution_base: Path,
+    model: "Model",
+    pool: ProcessPoolExecutor | None,
+) -> None:
+    from .model import Model
+
+    solution_csv = solution_base / "solution.csv"
+    solution_csv.parent.mkdir(parents=True, exist_ok=True)
+    solution.write_csv(solution_csv)
 
     groups_dir = solution_base / "groups"
     teachers_dir = solution_base / "teachers"
@@ -32,58 +137,57 @@ if __name__ == "__main__":
     teachers_dir.mkdir(exist_ok=True)
     rooms_dir.mkdir(exist_ok=True)
 
+    # One pass per axis splits the solution into each entity's rows.
+    by_group = solution.partition_by("Groups", as_dict=True)
+    by_teacher = solution.partition_by("Teacher", as_dict=True)
+    by_room = solution.partition_by("Room", as_dict=True)
+
     groups = Model.get_available_groups(solution)
+    jobs = []
     for group in groups:
-        timetable = Model.solution_to_timetable(solution, for_group=group)
-        dicts = Model.timetable_to_dicts(timetable)
-
         csv_file = groups_dir / f"timetable_group_{group}.csv"
         json_file = groups_dir / f"timetable_group_{group}.json"
-
-        timetable.write_csv(Path(csv_file))
-        json_file.write_text(json.dumps(dicts, indent=2))
+        jobs.append((by_group[(group,)], None, csv_file, json_file))
+    _run_all(pool, _write_timetable, jobs)
     print("[+] Wrote timetables for groups as both CSV and JSON.")
 
     teachers = Model.get_available_teachers(solution)
+    jobs = []
     for teacher in teachers:
-        timetable = Model.solution_to_timetable(solution, for_teacher=teacher)
-        dicts = Model.timetable_to_dicts(timetable)
-
-        teacher_url_safe = teacher.replace(" ", "_").replace(".", "")
+        teacher_url_safe = teacher.translate(_URL_SAFE)
         csv_file = teachers_dir / f"timetable_teacher_{teacher_url_safe}.csv"
         json_file = teachers_dir / f"timetable_teacher_{teacher_url_safe}.json"
-
-        timetable.write_csv(Path(csv_file))
-        json_file.write_text(json.dumps(dicts, indent=2))
+        jobs.append((by_teacher[(teacher,)], None, csv_file, json_file))
+    _run_all(pool, _write_timetable, jobs)
     print("[+] Wrote timetables for teachers as both CSV and JSON.")
 
     rooms = Model.get_available_rooms(solution)
+    jobs = []
     for room in rooms:
-        timetable = Model.solution_to_timetable(solution, for_room=room)
-        dicts = Model.timetable_to_dicts(timetable)
-
-        room_url_safe = room.replace(" ", "_").replace(".", "")
+        room_url_safe = room.translate(_URL_SAFE)
         csv_file = rooms_dir / f"timetable_room_{room_url_safe}.csv"
         json_file = rooms_dir / f"timetable_room_{room_url_safe}.json"
-
-        timetable.write_csv(Path(csv_file))
-        json_file.write_text(json.dumps(dicts, indent=2))
+        jobs.append((by_room[(room,)], room, csv_file, json_file))
+    _run_all(pool, _write_timetable, jobs)
     print("[+] Wrote timetables for rooms as both CSV and JSON.")
 
     summary = Model.get_summary(solution, model.rooms, model.groups)
     summary_file = solution_base / "summary.json"
-    summary_file.write_text(json.dumps(summary, indent=2))
+    summary_file.write_text(encode_json(summary))
     print("[+] Wrote summary as JSON.")
 
     conflicts = Model.detect_conflicts(solution)
+    total_conflicts = sum(len(conflicts[key]) for key in conflicts)
     conflicts_file = solution_base / "conflicts.json"
-    conflicts_file.write_text(json.dumps(conflicts, indent=2))
+    if total_conflicts > 0:
+        conflicts_file.write_text(encode_json(conflicts))
+    else:
+        conflicts_file.unlink(missing_ok=True)
 
     capacity_violations = Model.detect_capacity_violations(solution, model.rooms, model.groups)
     capacity_violations_file = solution_base / "capacity_violations.json"
-    capacity_violations_file.write_text(json.dumps(capacity_violations, indent=2))
+    capacity_violations_file.write_text(encode_json(capacity_violations))
 
-    total_conflicts = sum(len(conflicts[key]) for key in conflicts)
     total_capacity_violations = len(capacity_violations)
 
     if total_conflicts > 0:
@@ -99,3 +203,101 @@ if __name__ == "__main__":
         )
     else:
         print("[+] No capacity violations detected in the timetable(s).")
+
+
+def main() -> None:
+    parent = Path(__file__).parent
+
+    if len(sys.argv) > 1:
+        model_file = sys.argv[1]
+    else:
+        raise ValueError("Model file not specified.")
+
+    # Each variant beyond the first is another greedy run with a different
+    # tie-break seed.
+    variant_count = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    if variant_count < 1:
+        raise ValueError("Number of variants must be at least 1.")
+
+    from .model import Model
+    from .solver import Solver
+
+    model_path = parent / model_file
+    model_name = Path(model_file).stem
+
+    solution_base = parent / f"solutions/{model_name}"
+
+    # Tables are cached as Arrow IPC next to the model, along with the exact
+    # mtime and size of the file they came from. Any difference, including an
+    # older file copied in place, means the cache is stale.
+    model_cache = model_path.with_suffix(".cache")
+    cache_source = model_cache / "source.json"
+    stat = model_path.stat()
+    source = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+    try:
+        cache_fresh = json.loads(cache_source.read_text()) == source
+    except (OSError, ValueError):
+        cache_fresh = False
+
+    if cache_fresh:
+        model = Model.from_ipc(model_cache)
+    else:
+        model = Model.from_json(model_path)
+        # The cache is only an optimisation; a failed write must not stop the run.
+        try:
+            cache_source.unlink(missing_ok=True)
+            model.write_ipc(model_cache)
+            # Written after the tables, so it only exists for a complete cache.
+            cache_source.write_text(json.dumps(source))
+        except OSError as e:
+            print(f"[!] Could not cache the parsed model at {model_cache}: {e}")
+
+    if variant_count == 1:
+        solver = Solver(model)
+        variants = [(solver.solve(), solver.unassigned)]
+    else:
+        # The first variant is the deterministic run; the rest are seeded.
+        seeds = [None, *range(1, variant_count)]
+        run_variant = partial(_run_variant, model)
+        pool = _make_pool(variant_count, 2)
+        if pool is None:
+            solutions = list(map(run_variant, seeds))
+        else:
+            with pool:
+                solutions = list(pool.map(run_variant, seeds))
+        seen = set()
+        variants = []
+        for solution, unassigned in solutions:
+            key = _solution_key(solution)
+            if key not in seen:
+                seen.add(key)
+                variants.append((solution, unassigned))
+        print(
+            f"[+] Generated {len(variants)} distinct variants out of {variant_count} runs."
+        )
+
+    _clear_solution(solution_base)
+
+    # Each group, teacher and room gets its own timetable.
+    entities = max(
+        sum(solution[column].n_unique() for column in ("Groups", "Teacher", "Room"))
+        for solution, _ in variants
+    )
+    pool = _make_pool(entities, PARALLEL_MIN_ENTITIES)
+    try:
+        if variant_count == 1:
+            solution, unassigned = variants[0]
+            _report_unassigned(unassigned)
+            _write_solution(solution, solution_base, model, pool)
+        else:
+            for i, (solution, unassigned) in enumerate(variants):
+                print(f"[+] Variant {i}:")
+                _report_unassigned(unassigned)
+                _write_solution(solution, solution_base / f"variant_{i}", model, pool)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
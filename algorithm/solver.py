@@ -1,3 +1,5 @@
+import bisect
+import random
 import itertools
 import polars as pl
 from .model import Model
@@ -9,46 +11,127 @@ class Solver:
         self.model = model
         self.days = model.slots["days"]["day"].to_list()
         self.times = model.slots["times"]["time"].to_list()
-        self.breaks_raw = model.slots["breaks"].to_dicts()
         self.invalid_start_times = self._compute_invalid_start_times()
+        # Slots are encoded as `day_index * len(times) + time_index`; every
+        # teacher, room and group tracks its busy slots as one int bitmask, and
+        # `valid_mask` has a bit set for each slot a class may start in.
+        self.slot_names = [(day, time) for day in self.days for time in self.times]
+        self.day_mask = (1 << len(self.times)) - 1
+        self.valid_mask = 0
+        for slot, (day, time) in enumerate(self.slot_names):
+            if self._no_break(day, time):
+                self.valid_mask |= 1 << slot
         self.max_consec = model.modifiers.get("maximum_consecutive_classes", 2)
         self.max_slots_per_group_per_day = model.modifiers.get("maximum_slot_per_group_per_day", None)
+        # Limits that can never bind for this model are skipped in the hot loop:
+        # a day has only len(times) slots, so no longer run is possible.
+        self.check_consecutive = self.max_consec < len(self.times)
+        self.check_slots_per_day = self.max_slots_per_group_per_day is not None
 
         self.rooms = model.rooms
         self.teachers = model.teachers
         self.subjects = model.subjects
         self.groups = model.groups
 
-        self.room_types = {r["id"]: r["type"] for r in self.rooms.to_dicts()}
-        self.room_capacity = {r["id"]: r.get("capacity", 50) for r in self.rooms.to_dicts()}
-        self.group_size = {g["id"]: g.get("size", 30) for g in self.groups.to_dicts()}
+        # Lookups are zipped straight from columns; no per-row dicts are built.
+        room_ids = self.rooms["id"].to_list()
+        room_types = self.rooms["type"].to_list()
+        room_for = self.rooms["for"].to_list()
+        teacher_ids = self.teachers["id"].to_list()
+        subject_ids = self.subjects["id"].to_list()
+        group_ids = self.groups["id"].to_list()
+
+        self.room_ids = room_ids
+        self.teacher_ids = teacher_ids
+        self.group_ids = group_ids
+        self.room_types = dict(zip(room_ids, room_types))
+        self.room_capacity = model.room_capacity
+        self.group_size = model.group_size
         self.lab_for = {
-            r["id"]: set(r.get("for", []))
-            for r in self.rooms.to_dicts()
-            if r["type"] == "lab"
+            room_id: set(subjects or [])
+            for room_id, rtype, subjects in zip(room_ids, room_types, room_for)
+            if rtype == "lab"
         }
 
         self.teacher_subjects = {
-            t["id"]: set(t["subjects"]) for t in self.teachers.to_dicts()
+            teacher_id: set(subjects or [])
+            for teacher_id, subjects in zip(
+                teacher_ids, self.teachers["subjects"].to_list()
+            )
         }
-        self.subject_type = {s["id"]: s["type"] for s in self.subjects.to_dicts()}
+        self.subject_type = dict(zip(subject_ids, self.subjects["type"].to_list()))
 
-        self.subject_names = {s["id"]: s["name"] for s in self.subjects.to_dicts()}
-        self.teacher_names = {t["id"]: t["name"] for t in self.teachers.to_dicts()}
+        self.subject_names = dict(zip(subject_ids, self.subjects["name"].to_list()))
+        self.teacher_names = dict(zip(teacher_ids, self.teachers["name"].to_list()))
 
-        self.group_subjects = {}
-        for g in self.groups.to_dicts():
-            group_id = g["id"]
-            subjects = g.get("subjects", [])
-            self.group_subjects[group_id] = set(subjects)
+        self.group_subjects = {
+            group_id: set(subjects or [])
+            for group_id, subjects in zip(group_ids, self.groups["subjects"].to_list())
+        }
+
+        # Both explode queries are planned lazily and run in one collect_all.
+        subject_teachers, tasks = pl.collect_all(
+            [
+                self.teachers.lazy()
+                .select(pl.col("subjects").alias("subject"), "id")
+                .explode("subject")
+                .drop_nulls("subject")
+                .unique(maintain_order=True)
+                .group_by("subject", maintain_order=True)
+                .agg("id"),
+                self.groups.lazy()
+                .select(pl.col("subjects").alias("subject"), "id")
+                .explode("subject")
+                .drop_nulls("subject"),
+            ]
+        )
+        self.teachers_for_subject: dict[str, list[str]] = dict(
+            zip(subject_teachers["subject"].to_list(), subject_teachers["id"].to_list())
+        )
+
+        # Smallest rooms first, so each class takes the tightest room that fits.
+        self.rooms_for_subject: dict[str, list[str]] = {
+            subject_id: sorted(
+                (
+                    room_id
+                    for room_id in self.room_ids
+                    if self._valid_room_for_subject(room_id, subject_id)
+                ),
+                key=self.room_capacity.__getitem__,
+            )
+            for subject_id in self.subject_type
+        }
+
+        # Most constrained first: subjects with the fewest teacher/room
+        # combinations are placed before easier ones can use up their slots.
+        self.scheduling_tasks = list(
+            zip(tasks["subject"].to_list(), tasks["id"].to_list())
+        )
+        self.scheduling_tasks.sort(key=self._task_difficulty)
+
+        self._reset_indices()
+
+    def _task_difficulty(self, task):
+        subject_id, _ = task
+        return len(self.teachers_for_subject.get(subject_id, [])) * len(
+            self.rooms_for_subject.get(subject_id, [])
+        )
+
+    def _reset_indices(self):
+        # Every known id starts with an empty mask, so lookups never insert.
+        self.busy_teacher: dict[str, int] = dict.fromkeys(self.teacher_ids, 0)
+        self.busy_room: dict[str, int] = dict.fromkeys(self.room_ids, 0)
+        self.busy_group: dict[str, int] = dict.fromkeys(self.group_ids, 0)
+        # (subject, group) tasks that could not be placed, filled during solve.
+        self.unassigned: list[tuple[str, str]] = []
 
     def _compute_invalid_start_times(self):
         invalid = defaultdict(set)
-        for brk in self.breaks_raw:
+        for brk in self.model.slots["breaks"].iter_rows(named=True):
             days = self.days if brk["day"] == "*" else [brk["day"]]
             for d in days:
                 invalid[d].add(brk["time"])
-        return invalid
+        return {d: frozenset(invalid.get(d, ())) for d in self.days}
 
     def _valid_room_for_subject(self, room_id, subject_id):
         rtype = self.room_types[room_id]
@@ -63,146 +146,132 @@ class Solver:
             return True
         return False
 
-    def _teacher_available(self, teacher_id, day, time, schedule):
-        return all(
-            not (c["teacher"] == teacher_id and c["day"] == day and c["time"] == time)
-            for c in schedule
-        )
+    def _free_slots(self, teacher_id, group_ids):
+        """Bitmask of valid slots where the teacher and every group are free"""
+        busy = self.busy_teacher[teacher_id]
+        for group_id in group_ids:
+            busy |= self.busy_group[group_id]
+        return self.valid_mask & ~busy
 
-    def _room_available(self, room_id, day, time, schedule):
-        return all(
-            not (c["room"] == room_id and c["day"] == day and c["time"] == time)
-            for c in schedule
-        )
-
-    def _group_available(self, group_id, day, time, schedule):
-        """Check if a specific group is available at the given time"""
-        return all(
-            not (group_id in c["groups"] and c["day"] == day and c["time"] == time)
-            for c in schedule
-        )
+    def _room_available(self, room_id, bit):
+        return not self.busy_room[room_id] & bit
 
     def _no_break(self, day, time):
-        return time not in self.invalid_start_times.get(day, set())
-
-    def _capacity_sufficient(self, room_id, group_ids):
-        """Check if room capacity is sufficient for the given groups"""
-        room_cap = self.room_capacity.get(room_id, 50)
-        total_students = sum(self.group_size.get(group_id, 30) for group_id in group_ids)
-        return total_students <= room_cap
-
-    def _max_consecutive_ok(self, teacher_id, day, time, schedule):
-        day_classes = [
-            c for c in schedule if c["teacher"] == teacher_id and c["day"] == day
-        ]
-        times = sorted(
-            self.times.index(t) for t in [c["time"] for c in day_classes] + [time]
-        )
-        max_cons = 1
-        current_cons = 1
-        for i in range(1, len(times)):
-            if times[i] == times[i - 1] + 1:
-                current_cons += 1
-                max_cons = max(max_cons, current_cons)
-            else:
-                current_cons = 1
-        return max_cons <= self.max_consec
-
-    def _max_slots_per_group_per_day_ok(self, group_id, day, schedule):
+        return time not in self.invalid_start_times[day]
+
+    def _total_students(self, group_ids):
+        return sum(self.group_size.get(group_id, 30) for group_id in group_ids)
+
+    def _day_bits(self, mask, slot):
+        """The bits of `mask` that fall on the same day as `slot`"""
+        return (mask >> (slot - slot % len(self.times))) & self.day_mask
+
+    def _max_consecutive_ok(self, teacher_id, slot):
+        bits = self._day_bits(self.busy_teacher[teacher_id] | (1 << slot), slot)
+
+        # Each `bits &= bits << 1` trims one class off every run, so the
+        # number of rounds until nothing is left is the longest run.
+        longest = 0
+        while bits:
+            bits &= bits << 1
+            longest += 1
+        return longest <= self.max_consec
+
+    def _max_slots_per_group_per_day_ok(self, group_id, slot):
         if self.max_slots_per_group_per_day is None:
             return True
 
-        day_classes = [
-            c for c in schedule
-            if c["day"] == day and group_id in c["groups"]
-        ]
-        return len(day_classes) < self.max_slots_per_group_per_day
-
-    def solve(self) -> pl.DataFrame:
-        schedule = []
-
-        scheduling_tasks = []
-        for group_dict in self.groups.to_dicts():
-            group_id = group_dict["id"]
-            for subject_id in group_dict.get("subjects", []):
-                scheduling_tasks.append((subject_id, group_id))
-
-        for subject_id, group_id in scheduling_tasks:
-            available_teachers = [
-                t
-                for t in self.teachers.to_dicts()
-                if subject_id in self.teacher_subjects[t["id"]]
-            ]
+        day_classes = self._day_bits(self.busy_group[group_id], slot).bit_count()
+        return day_classes < self.max_slots_per_group_per_day
+
+    def _mark_busy(self, teacher_id, room_id, group_ids, bit):
+        self.busy_teacher[teacher_id] |= bit
+        self.busy_room[room_id] |= bit
+        for group_id in group_ids:
+            self.busy_group[group_id] |= bit
+
+    def _shuffled_tasks(self, seed):
+        """Scheduling tasks with each run of equally difficult tasks shuffled"""
+        rng = random.Random(seed)
+        tasks = []
+        for _, tied in itertools.groupby(
+            self.scheduling_tasks, key=self._task_difficulty
+        ):
+            tied = list(tied)
+            rng.shuffle(tied)
+            tasks.extend(tied)
+        return tasks
+
+    def solve(self, seed: int | None = None) -> pl.DataFrame:
+        # Output is accumulated column by column rather than as one dict per
+        # class, and handed to Polars in one go.
+        days, times, subjects, teachers, rooms_used, groups = [], [], [], [], [], []
+        self._reset_indices()
+
+        # Without a seed the greedy is deterministic; a seed only reorders
+        # tasks that tie on difficulty, so each seed is an equally valid run.
+        tasks = self.scheduling_tasks if seed is None else self._shuffled_tasks(seed)
+        for subject_id, group_id in tasks:
+            group_ids = frozenset([group_id])
+            available_teachers = self.teachers_for_subject.get(subject_id, [])
+            # Rooms are sorted by capacity, so the ones that fit are a suffix.
+            rooms = self.rooms_for_subject.get(subject_id, [])
+            start = bisect.bisect_left(
+                rooms,
+                self._total_students(group_ids),
+                key=self.room_capacity.__getitem__,
+            )
+            candidate_rooms = rooms[start:]
+            if not candidate_rooms:
+                self.unassigned.append((subject_id, group_id))
+                continue
 
             assigned = False
-            for teacher in available_teachers:
-                teacher_id = teacher["id"]
-                for day, time in itertools.product(self.days, self.times):
-                    if not self._no_break(day, time):
-                        continue
+            for teacher_id in available_teachers:
+                free = self._free_slots(teacher_id, group_ids)
+                while free:
+                    # Lowest set bit first, i.e. the earliest free slot.
+                    bit = free & -free
+                    free ^= bit
+                    slot = bit.bit_length() - 1
 
-                    if not self._teacher_available(teacher_id, day, time, schedule):
-                        continue
-                    if not self._group_available(group_id, day, time, schedule):
-                        continue
-                    if not self._max_consecutive_ok(teacher_id, day, time, schedule):
+                    if self.check_consecutive and not (
+                        self._max_consecutive_ok(teacher_id, slot)
+                    ):
                         continue
-                    if not self._max_slots_per_group_per_day_ok(group_id, day, schedule):
+                    if self.check_slots_per_day and not (
+                        self._max_slots_per_group_per_day_ok(group_id, slot)
+                    ):
                         continue
 
-                    for room in self.rooms.to_dicts():
-                        room_id = room["id"]
-                        if not self._valid_room_for_subject(room_id, subject_id):
-                            continue
-                        if not self._room_available(room_id, day, time, schedule):
-                            continue
-                        if not self._capacity_sufficient(room_id, [group_id]):
+                    for room_id in candidate_rooms:
+                        if not self._room_available(room_id, bit):
                             continue
 
-                        schedule.append(
-                            {
-                                "subject": subject_id,
-                                "subject_name": self.subject_names[subject_id],
-                                "teacher": teacher_id,
-                                "teacher_name": self.teacher_names[teacher_id],
-                                "room": room_id,
-                                "day": day,
-                                "time": time,
-                                "groups": [group_id],
-                            }
-                        )
+                        day, time = self.slot_names[slot]
+                        days.append(day)
+                        times.append(time)
+                        subjects.append(self.subject_names[subject_id])
+                        teachers.append(self.teacher_names[teacher_id])
+                        rooms_used.append(room_id)
+                        groups.append(", ".join(sorted(group_ids)))
+                        self._mark_busy(teacher_id, room_id, group_ids, bit)
                         assigned = True
                         break
                     if assigned:
                         break
                 if assigned:
                     break
+            if not assigned:
+                self.unassigned.append((subject_id, group_id))
 
-        rows = []
-        for c in schedule:
-            rows.append(
-                {
-                    "Day": c["day"],
-                    "Time": c["time"],
-                    "Subject": c["subject_name"],
-                    "Teacher": c["teacher_name"],
-                    "Room": c["room"],
-                    "Groups": ", ".join(c["groups"]),
-                }
-            )
-
-        if rows:
-            df = pl.DataFrame(rows)
-            df = df.sort(["Day", "Time"])
-            return df
-        else:
-            return pl.DataFrame(
-                {
-                    "Day": [],
-                    "Time": [],
-                    "Subject": [],
-                    "Teacher": [],
-                    "Room": [],
-                    "Groups": [],
-                }
-            )
+        return pl.DataFrame(
+            {
+                "Day": days,
+                "Time": times,
+                "Subject": subjects,
+                "Teacher": teachers,
+                "Room": rooms_used,
+                "Groups": groups,
+            }
+        ).sort(["Day", "Time"])